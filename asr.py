@@ -3,7 +3,12 @@
 调用硅基流动的 SenseVoiceSmall API 进行音频识别
 """
 import os
+import csv
 import json
+import shutil
+import tempfile
+import subprocess
+from itertools import islice
 import requests
 from dotenv import load_dotenv
 
@@ -12,10 +17,11 @@ load_dotenv()
 
 
 class SenseVoiceASR:
-    def __init__(self, cache_dir="cache"):
+    def __init__(self, cache_dir="cache", chunk_seconds=None):
         """
         初始化 ASR 客户端
         :param cache_dir: 缓存目录，用于存储转录文本
+        :param chunk_seconds: 分段识别时每段音频的时长（秒），默认读取 ASR_CHUNK_SECONDS
         """
         self.api_key = os.getenv("SILICONFLOW_API_KEY")
         if not self.api_key:
@@ -23,6 +29,7 @@ class SenseVoiceASR:
         
         self.api_url = "https://api.siliconflow.cn/v1/audio/transcriptions"
         self.model = "FunAudioLLM/SenseVoiceSmall"
+        self.chunk_seconds = chunk_seconds or int(os.getenv("ASR_CHUNK_SECONDS", "120"))
         
         # 创建缓存目录
         self.cache_dir = cache_dir
@@ -39,6 +46,55 @@ class SenseVoiceASR:
         cache_filename = os.path.splitext(audio_filename)[0] + "_transcript.json"
         return os.path.join(self.cache_dir, cache_filename)
     
+    def _get_segments_path(self, audio_path):
+        """
+        获取音频文件对应的分段缓存路径（JSON Lines，每行一个分段）
+        :param audio_path: 音频文件路径
+        :return: 分段缓存文件路径
+        """
+        audio_filename = os.path.basename(audio_path)
+        cache_filename = os.path.splitext(audio_filename)[0] + "_segments.jsonl"
+        return os.path.join(self.cache_dir, cache_filename)
+    
+    def _get_progress_path(self, audio_path):
+        """
+        获取分段识别进度文件路径，每行记录一个已完成切片的分段
+        :param audio_path: 音频文件路径
+        :return: 进度文件路径
+        """
+        audio_filename = os.path.basename(audio_path)
+        cache_filename = os.path.splitext(audio_filename)[0] + "_segments.partial.jsonl"
+        return os.path.join(self.cache_dir, cache_filename)
+    
+    def _load_progress(self, audio_path, chunk_count):
+        """
+        读取上次中断时已完成的切片
+        切片时长或切片数量与本次不一致时视为无效
+        :param audio_path: 音频文件路径
+        :param chunk_count: 本次切片数量
+        :return: {切片序号: 分段列表}
+        """
+        progress_path = self._get_progress_path(audio_path)
+        if not os.path.exists(progress_path):
+            return {}
+        
+        done = {}
+        try:
+            with open(progress_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    record = json.loads(line)
+                    if record.get('chunk_seconds') != self.chunk_seconds or record.get('count') != chunk_count:
+                        return {}
+                    done[record['index']] = record['segments']
+        except (ValueError, KeyError) as e:
+            # 最后一行可能写到一半，之前的记录仍然有效
+            print(f"[警告] 识别进度文件不完整: {str(e)}")
+        
+        return done
+    
     def _load_from_cache(self, audio_path):
         """
         从缓存加载转录文本
@@ -67,11 +123,12 @@ class SenseVoiceASR:
             print(f"[警告] 读取缓存失败: {str(e)}，将重新转录")
             return None
     
-    def _save_to_cache(self, audio_path, text):
+    def _save_to_cache(self, audio_path, text, segments):
         """
         保存转录文本到缓存
         :param audio_path: 音频文件路径
         :param text: 转录文本
+        :param segments: 带时间戳的分段列表，单独写入 JSON Lines 文件
         """
         cache_path = self._get_cache_path(audio_path)
         
@@ -83,6 +140,13 @@ class SenseVoiceASR:
                 'model': self.model
             }
             
+            segments_path = self._get_segments_path(audio_path)
+            with open(segments_path, 'w', encoding='utf-8') as f:
+                for segment in segments:
+                    f.write(json.dumps(segment, ensure_ascii=False) + "\n")
+            cache_data['segments_path'] = segments_path
+            cache_data['segment_count'] = len(segments)
+            
             with open(cache_path, 'w', encoding='utf-8') as f:
                 json.dump(cache_data, f, ensure_ascii=False, indent=2)
             
@@ -91,56 +155,184 @@ class SenseVoiceASR:
         except Exception as e:
             print(f"[警告] 保存缓存失败: {str(e)}")
     
-    def transcribe(self, audio_path, use_cache=True):
+    def iter_segments(self, audio_path):
         """
-        将音频文件转换为文字（带缓存机制）
+        逐行读取缓存的分段，按需加载，不会一次性读入整个转录
         :param audio_path: 音频文件路径
-        :param use_cache: 是否使用缓存
-        :return: 识别出的文本内容
+        :return: 分段生成器，每项为 {'start': 秒, 'end': 秒, 'text': 文本}
         """
-        if not os.path.exists(audio_path):
-            raise FileNotFoundError(f"音频文件不存在: {audio_path}")
+        segments_path = self._get_segments_path(audio_path)
+        if not os.path.exists(segments_path):
+            return
         
-        # 尝试从缓存加载
-        if use_cache:
-            cached_text = self._load_from_cache(audio_path)
-            if cached_text:
-                print(f"[缓存] 使用缓存的转录文本")
-                return cached_text
+        with open(segments_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    
+    def load_segment(self, audio_path, index):
+        """
+        读取指定序号的单个分段
+        :param audio_path: 音频文件路径
+        :param index: 分段序号（从 0 开始）
+        :return: 分段字典，不存在时返回 None
+        """
+        return next(islice(self.iter_segments(audio_path), index, None), None)
+    
+    def _split_audio(self, audio_path, work_dir):
+        """
+        使用 FFmpeg 将音频按固定时长切分
+        :param audio_path: 音频文件路径
+        :param work_dir: 切分结果输出目录
+        :return: [(分段文件路径, 起始秒, 结束秒), ...]，切分失败时返回 None
+        """
+        ext = os.path.splitext(audio_path)[1] or ".mp3"
+        list_path = os.path.join(work_dir, "chunks.csv")
+        command = [
+            "ffmpeg", "-v", "error", "-y",
+            "-i", audio_path,
+            "-f", "segment",
+            "-segment_time", str(self.chunk_seconds),
+            "-segment_list", list_path,
+            "-segment_list_type", "csv",
+            "-c", "copy",
+            os.path.join(work_dir, f"chunk_%04d{ext}"),
+        ]
         
-        print(f"[ASR] 正在识别音频: {audio_path}")
+        try:
+            subprocess.run(command, check=True, capture_output=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"[警告] 音频切分失败: {str(e)}，将整段识别")
+            return None
+        
+        chunks = []
+        with open(list_path, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.reader(f):
+                if len(row) < 3:
+                    continue
+                chunks.append((os.path.join(work_dir, row[0]), float(row[1]), float(row[2])))
         
-        # 准备请求
+        return chunks or None
+    
+    def _request_transcription(self, audio_path):
+        """
+        调用识别接口，请求带分段时间戳的详细结果
+        :param audio_path: 音频文件路径
+        :return: 接口返回的 JSON
+        """
         headers = {
             "Authorization": f"Bearer {self.api_key}"
         }
         
-        files = {
-            "file": open(audio_path, "rb"),
-            "model": (None, self.model)
-        }
-        
-        try:
+        with open(audio_path, "rb") as audio_file:
+            files = {
+                "file": audio_file,
+                "model": (None, self.model),
+                "response_format": (None, "verbose_json"),
+                "timestamp_granularities[]": (None, "segment"),
+            }
+            
             response = requests.post(
                 self.api_url,
                 headers=headers,
                 files=files,
                 timeout=300  # 5分钟超时
             )
-            
-            response.raise_for_status()
-            result = response.json()
-            
-            # 提取转录文本
-            text = result.get("text", "")
-            
-            print(f"[ASR] 识别完成，文本长度: {len(text)} 字符")
-            
-            # 保存到缓存
+        
+        response.raise_for_status()
+        return response.json()
+    
+    @staticmethod
+    def _parse_segments(result, chunk_start, chunk_end):
+        """
+        从识别结果中提取分段，并换算为整段音频上的时间
+        接口未返回分段时，整个切片作为一个分段
+        :param result: 接口返回的 JSON
+        :param chunk_start: 切片在原音频中的起始秒
+        :param chunk_end: 切片在原音频中的结束秒
+        :return: 分段列表
+        """
+        segments = []
+        for item in result.get("segments") or []:
+            text = (item.get("text") or "").strip()
+            if not text:
+                continue
+            segments.append({
+                'start': round(chunk_start + float(item.get("start", 0)), 2),
+                'end': round(chunk_start + float(item.get("end", 0)), 2),
+                'text': text,
+            })
+        
+        if not segments:
+            text = (result.get("text") or "").strip()
             if text:
-                self._save_to_cache(audio_path, text)
+                segments.append({
+                    'start': round(chunk_start, 2),
+                    'end': round(chunk_end, 2) if chunk_end is not None else None,
+                    'text': text,
+                })
+        
+        return segments
+    
+    def transcribe_segments(self, audio_path, use_cache=True):
+        """
+        将音频文件转换为带时间戳的分段文本（带缓存机制）
+        长音频会先按 chunk_seconds 切分，逐段识别后按切片起点换算时间
+        :param audio_path: 音频文件路径
+        :param use_cache: 是否使用缓存
+        :return: 分段列表 [{'start': 秒, 'end': 秒, 'text': 文本}, ...]
+        """
+        if not os.path.exists(audio_path):
+            raise FileNotFoundError(f"音频文件不存在: {audio_path}")
+        
+        # 尝试从缓存加载
+        if use_cache:
+            cached_text = self._load_from_cache(audio_path)
+            if cached_text:
+                segments = list(self.iter_segments(audio_path))
+                if segments:
+                    print(f"[缓存] 使用缓存的分段转录（{len(segments)} 段）")
+                    return segments
+                # 旧版本的缓存只有文本，作为一个不带时间戳的分段使用，避免重新识别
+                print(f"[缓存] 缓存中没有分段时间戳，整段文本作为一个分段使用")
+                return [{'start': 0, 'end': None, 'text': cached_text}]
+        
+        print(f"[ASR] 正在分段识别音频: {audio_path}")
+        
+        work_dir = tempfile.mkdtemp(prefix="asr_chunks_")
+        try:
+            chunks = self._split_audio(audio_path, work_dir) or [(audio_path, 0.0, None)]
+            
+            # 续接上次中断的识别，每完成一个切片就追加写入进度文件
+            progress_path = self._get_progress_path(audio_path)
+            done = self._load_progress(audio_path, len(chunks)) if use_cache else {}
+            if done:
+                print(f"[缓存] 发现未完成的识别进度，已完成 {len(done)}/{len(chunks)} 个切片")
             
-            return text
+            with open(progress_path, 'w', encoding='utf-8') as progress:
+                for index in sorted(done):
+                    progress.write(json.dumps({
+                        'index': index, 'count': len(chunks),
+                        'chunk_seconds': self.chunk_seconds, 'segments': done[index],
+                    }, ensure_ascii=False) + "\n")
+                
+                segments = []
+                for index, (chunk_path, chunk_start, chunk_end) in enumerate(chunks):
+                    if index in done:
+                        segments.extend(done[index])
+                        continue
+                    if len(chunks) > 1:
+                        print(f"[ASR] 识别分段 {index + 1}/{len(chunks)}")
+                    result = self._request_transcription(chunk_path)
+                    chunk_segments = self._parse_segments(result, chunk_start, chunk_end)
+                    segments.extend(chunk_segments)
+                    
+                    progress.write(json.dumps({
+                        'index': index, 'count': len(chunks),
+                        'chunk_seconds': self.chunk_seconds, 'segments': chunk_segments,
+                    }, ensure_ascii=False) + "\n")
+                    progress.flush()
         
         except requests.exceptions.RequestException as e:
             print(f"[错误] ASR 请求失败: {str(e)}")
@@ -149,9 +341,27 @@ class SenseVoiceASR:
             raise
         
         finally:
-            # 关闭文件
-            if 'files' in locals():
-                files['file'][1].close() if isinstance(files['file'], tuple) else files['file'].close()
+            shutil.rmtree(work_dir, ignore_errors=True)
+        
+        text = "".join(segment['text'] for segment in segments)
+        print(f"[ASR] 识别完成，共 {len(segments)} 段，文本长度: {len(text)} 字符")
+        
+        # 保存到缓存，完整结果写入后不再需要进度文件
+        if text:
+            self._save_to_cache(audio_path, text, segments)
+        os.remove(progress_path)
+        
+        return segments
+    
+    def transcribe(self, audio_path, use_cache=True):
+        """
+        将音频文件转换为文字（带缓存机制）
+        :param audio_path: 音频文件路径
+        :param use_cache: 是否使用缓存
+        :return: 识别出的文本内容
+        """
+        segments = self.transcribe_segments(audio_path, use_cache)
+        return "".join(segment['text'] for segment in segments)
 
 
 if __name__ == "__main__":
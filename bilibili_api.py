@@ -4,6 +4,7 @@ B站 API 模块
 """
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 
 class BilibiliAPI:
@@ -49,6 +50,9 @@ class BilibiliAPI:
                     'owner': item.get('owner', {}).get('name', ''),
                     'duration': item.get('duration', 0),
                     'pic': item.get('pic', ''),
+                    'view': item.get('stat', {}).get('view', 0),
+                    'like': item.get('stat', {}).get('like', 0),
+                    'tname': item.get('tname', ''),
                 }
                 videos.append(video)
             
@@ -88,6 +92,58 @@ class BilibiliAPI:
             print(f"[错误] 获取视频信息失败: {str(e)}")
             raise
 
+    
+    def get_video_details(self, bvid):
+        """
+        获取视频的播放数据和标签
+        :param bvid: 视频BV号
+        :return: {'bvid', 'view', 'like', 'tname', 'tags': [...]}
+        """
+        url = f"https://api.bilibili.com/x/web-interface/view/detail?bvid={bvid}"
+        
+        try:
+            response = requests.get(url, headers=self.headers, timeout=10)
+            response.raise_for_status()
+            data = response.json()
+            
+            if data.get('code') != 0:
+                raise ValueError(f"获取视频详情失败: {data.get('message', '未知错误')}")
+            
+            detail = data.get('data', {})
+            view = detail.get('View', {})
+            return {
+                'bvid': bvid,
+                'view': view.get('stat', {}).get('view', 0),
+                'like': view.get('stat', {}).get('like', 0),
+                'tname': view.get('tname', ''),
+                'tags': [tag.get('tag_name', '') for tag in detail.get('Tags') or []],
+            }
+        
+        except requests.exceptions.RequestException as e:
+            print(f"[错误] 获取视频详情失败: {str(e)}")
+            raise
+    
+    def get_video_details_batch(self, bvids, max_workers=4):
+        """
+        并发获取多个视频的播放数据和标签，单个视频失败不影响其他视频
+        :param bvids: 视频BV号列表
+        :param max_workers: 并发请求数
+        :return: {bvid: 详情字典}，获取失败的视频不在结果中
+        """
+        def fetch(bvid):
+            try:
+                return self.get_video_details(bvid)
+            except Exception as e:
+                print(f"[警告] {bvid} 详情获取失败: {str(e)}")
+                return None
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(fetch, bvids))
+        
+        details = {detail['bvid']: detail for detail in results if detail}
+        print(f"[API] 成功获取 {len(details)}/{len(bvids)} 个视频的详情")
+        return details
+
 
 def get_sessdata_guide():
     """
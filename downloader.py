@@ -3,23 +3,55 @@ B站视频音频下载模块
 使用 yt-dlp 下载指定 BV 号的视频音频
 """
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import yt_dlp
 
 
 class BilibiliDownloader:
-    def __init__(self, download_dir="downloads"):
+    def __init__(self, download_dir="downloads", concurrent_fragments=4, quiet=False):
         """
         初始化下载器
         :param download_dir: 音频文件下载目录
+        :param concurrent_fragments: 分片格式同时下载的分片数
+        :param quiet: 是否关闭 yt-dlp 的控制台输出
         """
         self.download_dir = download_dir
+        self.concurrent_fragments = concurrent_fragments
+        self.quiet = quiet
         os.makedirs(download_dir, exist_ok=True)
     
-    def download_audio(self, bv_id, force_download=False):
+    def build_ydl_opts(self, progress_hooks=None):
+        """
+        生成 yt-dlp 配置，输出路径在每次下载时单独设置
+        :param progress_hooks: 下载进度回调列表（可选）
+        :return: yt-dlp 配置字典
+        """
+        return {
+            'format': 'worstaudio/worst',  # 使用最低音质，节省带宽和时间
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': '64',  # 64kbps 低音质，足够语音识别使用
+            }],
+            'outtmpl': os.path.join(self.download_dir, "%(id)s.%(ext)s"),
+            'concurrent_fragment_downloads': self.concurrent_fragments,
+            'continuedl': True,  # 续传上次中断留下的 .part 文件
+            'retries': 10,
+            'fragment_retries': 10,
+            'progress_hooks': list(progress_hooks or []),
+            'quiet': self.quiet,
+            'noprogress': self.quiet,
+            'no_warnings': False,
+        }
+    
+    def download_audio(self, bv_id, force_download=False, ydl=None):
         """
         下载B站视频的音频（带缓存机制）
         :param bv_id: B站视频的BV号（如 BV1xx411c7mD）
         :param force_download: 是否强制重新下载（忽略缓存）
+        :param ydl: 复用的 yt_dlp.YoutubeDL 实例（可选），不传则新建
         :return: 下载的音频文件路径
         """
         # 构造B站视频URL
@@ -43,22 +75,18 @@ class BilibiliDownloader:
                 print(f"[警告] 发现空文件，将重新下载")
                 os.remove(output_path)
         
-        # yt-dlp 配置
-        ydl_opts = {
-            'format': 'worstaudio/worst',  # 使用最低音质，节省带宽和时间
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '64',  # 64kbps 低音质，足够语音识别使用
-            }],
-            'outtmpl': os.path.join(self.download_dir, f"{bv_id}.%(ext)s"),
-            'quiet': False,
-            'no_warnings': False,
-        }
+        outtmpl = os.path.join(self.download_dir, f"{bv_id}.%(ext)s")
         
         try:
             print(f"[下载] 开始下载 {bv_id} 的音频...")
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            if ydl is None:
+                ydl_opts = self.build_ydl_opts()
+                ydl_opts['outtmpl'] = outtmpl
+                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                    ydl.download([url])
+            else:
+                # 复用实例时只替换输出路径
+                ydl.params['outtmpl']['default'] = outtmpl
                 ydl.download([url])
             
             # 验证下载完成
@@ -71,12 +99,176 @@ class BilibiliDownloader:
         
         except Exception as e:
             print(f"[错误] 下载失败: {str(e)}")
-            # 清理可能的损坏文件
+            # 清理可能的损坏文件：mp3 由 FFmpeg 直接写出，中途失败会留下截断但非空的文件
+            # 下载中的 *.part 文件不在此处删除，由 yt-dlp 在下次运行时续传
             if os.path.exists(output_path):
                 os.remove(output_path)
             raise
 
 
+class DownloadManager:
+    """
+    并行下载管理器：线程池中每个工作线程复用一个 YoutubeDL 实例，
+    所有下载共享一个全局带宽上限
+    """
+    
+    def __init__(self, downloader=None, max_workers=None, bandwidth_limit=None):
+        """
+        :param downloader: BilibiliDownloader 实例（可选），默认新建一个静默的下载器
+        :param max_workers: 同时下载的视频数，默认读取 DOWNLOAD_MAX_WORKERS
+        :param bandwidth_limit: 全局带宽上限（MB/s），默认读取 DOWNLOAD_BANDWIDTH_LIMIT，0 表示不限
+        """
+        self.downloader = downloader or BilibiliDownloader(quiet=True)
+        if max_workers is None:
+            max_workers = int(os.getenv("DOWNLOAD_MAX_WORKERS", "3"))
+        if bandwidth_limit is None:
+            bandwidth_limit = float(os.getenv("DOWNLOAD_BANDWIDTH_LIMIT", "0"))
+        self.max_workers = max(1, max_workers)
+        self.bandwidth_limit = int(bandwidth_limit * 1024 * 1024)  # 字节/秒
+        
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="download")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._instances = []       # 所有工作线程创建的 YoutubeDL
+        self._active = []          # 正在下载的 YoutubeDL
+        self._file_bytes = {}      # 各文件上次回调时的已下载字节数
+        self._queued = 0
+        self._completed = 0
+        self._failed = 0
+        self._total_bytes = 0
+        self._busy_seconds = 0.0   # 有下载进行的累计时长，用于计算传输速率
+        self._busy_since = None
+    
+    def _progress_hook(self, d):
+        """
+        yt-dlp 进度回调，累计本次运行下载的字节数
+        续传 .part 时 downloaded_bytes 包含之前已下载的部分，
+        因此以每个文件第一次回调的值为基准，只累计之后的增量
+        """
+        downloaded = d.get('downloaded_bytes')
+        filename = d.get('filename')
+        if downloaded is None or not filename:
+            return
+        
+        with self._lock:
+            previous = self._file_bytes.get(filename, downloaded)
+            if downloaded > previous:
+                self._total_bytes += downloaded - previous
+            self._file_bytes[filename] = downloaded
+            if d.get('status') == 'finished':
+                self._file_bytes.pop(filename, None)
+    
+    def _get_ydl(self):
+        """
+        获取当前工作线程的 YoutubeDL 实例，不存在则创建
+        """
+        ydl = getattr(self._local, 'ydl', None)
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(self.downloader.build_ydl_opts([self._progress_hook]))
+            self._local.ydl = ydl
+            with self._lock:
+                self._instances.append(ydl)
+        return ydl
+    
+    def _rebalance(self):
+        """
+        将全局带宽上限平均分给正在下载的实例（调用方需持有锁）
+        普通 HTTP 下载每次限速时都会重新读取 ratelimit，修改对进行中的下载立即生效；
+        分片格式由 FragmentFD 复制一份 params，只对之后开始的下载生效，
+        且每个分片线程各自限速，因此份额还要再除以同时下载的分片数
+        B站 DASH 音频通常是单个 HTTP 流，分片并发一般不起作用
+        """
+        if not self.bandwidth_limit or not self._active:
+            return
+        fragments = max(1, self.downloader.concurrent_fragments)
+        share = max(1, self.bandwidth_limit // (len(self._active) * fragments))
+        for ydl in self._active:
+            ydl.params['ratelimit'] = share
+    
+    def _run(self, bv_id, force_download):
+        """
+        在工作线程中执行单个下载
+        """
+        with self._lock:
+            self._queued -= 1
+        ydl = self._get_ydl()
+        with self._lock:
+            if not self._active:
+                self._busy_since = time.monotonic()
+            self._active.append(ydl)
+            self._rebalance()
+        
+        try:
+            path = self.downloader.download_audio(bv_id, force_download, ydl=ydl)
+            with self._lock:
+                self._completed += 1
+            return path
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._active.remove(ydl)
+                if not self._active:
+                    self._busy_seconds += time.monotonic() - self._busy_since
+                    self._busy_since = None
+                self._rebalance()
+    
+    def submit(self, bv_id, force_download=False):
+        """
+        提交一个下载任务
+        :param bv_id: 视频BV号
+        :param force_download: 是否强制重新下载
+        :return: Future，结果为音频文件路径
+        """
+        with self._lock:
+            self._queued += 1
+        return self._executor.submit(self._run, bv_id, force_download)
+    
+    def stats(self):
+        """
+        获取下载统计，mb_per_s 只按有下载进行的时间计算，下载全部结束后不再下降
+        :return: {'queued', 'active', 'completed', 'failed', 'mb_per_s'}
+        """
+        with self._lock:
+            elapsed = self._busy_seconds
+            if self._busy_since is not None:
+                elapsed += time.monotonic() - self._busy_since
+            elapsed = max(elapsed, 1e-6)
+            return {
+                'queued': self._queued,
+                'active': len(self._active),
+                'completed': self._completed,
+                'failed': self._failed,
+                'mb_per_s': self._total_bytes / elapsed / 1024 / 1024,
+            }
+    
+    def shutdown(self, wait=True, cancel_pending=False):
+        """
+        关闭线程池并释放空闲的 YoutubeDL 实例
+        :param wait: 是否等待正在进行的下载
+        :param cancel_pending: 是否取消尚未开始的下载
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_pending)
+        with self._lock:
+            if cancel_pending:
+                self._queued = 0
+            # 不等待时仍在下载的实例由其工作线程继续使用，不能关闭
+            instances = [ydl for ydl in self._instances if ydl not in self._active]
+            self._instances = [ydl for ydl in self._instances if ydl in self._active]
+        for ydl in instances:
+            ydl.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        # 出错或 Ctrl-C 时取消排队中的下载，避免退出时等整个队列下载完
+        failed = exc_type is not None
+        self.shutdown(wait=not failed, cancel_pending=failed)
+
+
 if __name__ == "__main__":
     # 测试代码
     downloader = BilibiliDownloader()
@@ -4,11 +4,13 @@ Bilibili QuickView - B站视频快速预览工具
 """
 import os
 import sys
+import json
 from datetime import datetime
-from downloader import BilibiliDownloader
+from downloader import BilibiliDownloader, DownloadManager
 from asr import SenseVoiceASR
-from summarizer import DeepSeekSummarizer
+from summarizer import DeepSeekSummarizer, format_timestamp
 from bilibili_api import BilibiliAPI, get_sessdata_guide
+from triage import TriageConfig, triage_videos
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -26,13 +28,26 @@ def get_bilibili_api():
     return _bilibili_api
 
 
-def save_result(bv_id, transcript, analysis, video_title=""):
+def format_usage(usage):
+    """
+    将 DeepSeekSummarizer.usage_report 的结果格式化为一行文字
+    :param usage: 用量汇总字典
+    """
+    routes = "+".join(usage['routes']) or "无"
+    return (f"路由 {routes} | {usage['prompt_tokens']}+{usage['completion_tokens']} tokens | "
+            f"约 ¥{usage['cost']:.4f} | 耗时 {usage['latency']:.1f}s")
+
+
+def save_result(bv_id, transcript, analysis, video_title="", segments=None, chapters=None, usage=None):
     """
     保存分析结果到文件
     :param bv_id: 视频BV号
     :param transcript: 转录文本
     :param analysis: AI分析结果
     :param video_title: 视频标题（可选）
+    :param segments: 带时间戳的转录分段（可选），有则按分段输出转录
+    :param chapters: 章节索引 ChapterIndex（可选），同时另存为 JSON
+    :param usage: AI 用量汇总（可选）
     """
     output_dir = "output"
     os.makedirs(output_dir, exist_ok=True)
@@ -57,25 +72,46 @@ def save_result(bv_id, transcript, analysis, video_title=""):
         
         f.write(f"**视频BV号**: {bv_id}\n\n")
         f.write(f"**分析时间**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        if usage:
+            f.write(f"**AI 用量**: {format_usage(usage)}\n\n")
         f.write("---\n\n")
         
         f.write("## AI 智能分析\n\n")
         f.write(analysis)
         f.write("\n\n")
         
+        if chapters:
+            f.write("---\n\n")
+            f.write("## 章节索引\n\n")
+            for i, (start, title) in enumerate(chapters):
+                f.write(f"- [{format_timestamp(start)}]({chapters.url(bv_id, i)}) {title}\n")
+            f.write("\n")
+        
         f.write("---\n\n")
         f.write("## 完整转录文本\n\n")
-        f.write(transcript)
-        f.write("\n")
+        if segments:
+            for segment in segments:
+                f.write(f"**[{format_timestamp(segment['start'])}]** {segment['text']}\n\n")
+        else:
+            f.write(transcript)
+            f.write("\n")
+    
+    # 章节索引另存为 JSON，方便其他程序读取
+    if chapters:
+        chapters_file = os.path.splitext(output_file)[0] + "_chapters.json"
+        with open(chapters_file, "w", encoding="utf-8") as f:
+            json.dump(chapters.to_dict(), f, ensure_ascii=False)
     
     print(f"\n✅ 分析报告已保存至: {output_file}")
     return output_file
 
 
-def process_video(bv_id):
+def process_video(bv_id, summarizer=None, audio_path=None):
     """
     处理单个B站视频
     :param bv_id: 视频BV号
+    :param summarizer: 共享的 DeepSeekSummarizer（可选），批量处理时复用以共享预算
+    :param audio_path: 已下载的音频路径（可选），传入时跳过下载步骤
     """
     print("\n" + "=" * 60)
     print(f"🎬 开始处理视频: {bv_id}")
@@ -96,13 +132,17 @@ def process_video(bv_id):
         
         # 步骤1: 下载音频（带缓存）
         print("📥 [1/3] 下载视频音频...")
-        downloader = BilibiliDownloader()
-        audio_path = downloader.download_audio(bv_id)
+        if audio_path is None:
+            downloader = BilibiliDownloader()
+            audio_path = downloader.download_audio(bv_id)
+        else:
+            print(f"[下载] 使用后台下载的音频: {audio_path}")
         
         # 步骤2: 音频转文字（带缓存）
         print("\n🎤 [2/3] 语音识别转录...")
         asr = SenseVoiceASR()
-        transcript = asr.transcribe(audio_path)
+        segments = asr.transcribe_segments(audio_path)
+        transcript = "".join(segment['text'] for segment in segments)
         
         if not transcript or len(transcript.strip()) == 0:
             print("⚠️ 警告: 转录文本为空，可能是音频无内容或识别失败")
@@ -110,17 +150,31 @@ def process_video(bv_id):
         
         # 步骤3: AI 分析
         print("\n🤖 [3/3] AI 智能分析...")
-        summarizer = DeepSeekSummarizer()
+        if summarizer is None:
+            summarizer = DeepSeekSummarizer()
+        usage_start = len(summarizer.usage_log)
         analysis = summarizer.analyze(transcript, bv_id)
         
+        # 本地抽取和短视频（brief）不再为章节单独调用 LLM，只有一个分段时也无从划分章节
+        # 章节索引失败不影响主流程
+        chapters = None
+        if summarizer.last_route['name'] not in ('local', 'brief') and len(segments) >= 2:
+            try:
+                chapters = summarizer.build_chapters(segments, model=summarizer.last_route['model'])
+            except Exception as e:
+                print(f"⚠️ 章节索引生成失败: {str(e)}")
+        
         # 保存结果（带标题）
-        output_file = save_result(bv_id, transcript, analysis, video_title)
+        usage = summarizer.usage_report(usage_start)
+        output_file = save_result(bv_id, transcript, analysis, video_title, segments, chapters, usage)
         
         # 在控制台显示AI分析结果
         print("\n" + "=" * 60)
         print("📊 AI 分析结果")
         print("=" * 60)
         print(analysis)
+        print("=" * 60)
+        print(f"💰 AI 用量: {format_usage(usage)}")
         print("=" * 60 + "\n")
         
         print(f"✨ 处理完成！可以查看完整报告: {output_file}")
@@ -131,9 +185,34 @@ def process_video(bv_id):
         traceback.print_exc()
 
 
-def process_watchlater_batch():
+def triage_watchlater(videos, api):
+    """
+    按规则筛选稍后再看视频并排序，打印筛选结果
+    :param videos: 稍后再看视频列表
+    :param api: BilibiliAPI 实例
+    :return: 排好序的待处理视频列表
+    """
+    config = TriageConfig.from_env()
+    print(f"\n🔍 正在筛选视频（排序: {config.order}）...")
+    kept, skipped = triage_videos(videos, config, api)
+    
+    if skipped:
+        print(f"\n⏭️ 跳过 {len(skipped)} 个视频：")
+        for video, reason in skipped:
+            print(f"   [{video['bvid']}] {video['title']} - {reason}")
+    
+    print(f"\n✅ 保留 {len(kept)} 个视频，处理顺序：")
+    for i, video in enumerate(kept, 1):
+        print(f"{i}. [{video['bvid']}] {video['title']}")
+        print(f"   UP主: {video['owner']} | 时长: {video['duration'] // 60}分钟 | 得分: {video['score']}")
+    
+    return kept
+
+
+def process_watchlater_batch(auto_triage=False):
     """
     批量处理稍后再看列表
+    :param auto_triage: 是否跳过询问，直接按筛选规则处理
     """
     print("\n" + "=" * 60)
     print("📋 批量处理稍后再看")
@@ -168,7 +247,10 @@ def process_watchlater_batch():
         print("=" * 60 + "\n")
         
         # 询问是否批量处理
-        choice = input("是否批量处理这些视频？(y/n，或输入序号范围如 1-5): ").strip().lower()
+        if auto_triage:
+            choice = 't'
+        else:
+            choice = input("是否批量处理这些视频？(y/n，t=按规则筛选排序，或输入序号范围如 1-5): ").strip().lower()
         
         if choice == 'n':
             print("👋 已取消")
@@ -178,6 +260,8 @@ def process_watchlater_batch():
         to_process = []
         if choice == 'y':
             to_process = videos
+        elif choice == 't':
+            to_process = triage_watchlater(videos, api)
         elif '-' in choice:
             # 处理范围输入（如 1-5）
             try:
@@ -195,28 +279,41 @@ def process_watchlater_batch():
             print("❌ 无效的输入")
             return
         
+        if not to_process:
+            print("\n✅ 没有需要处理的视频")
+            return
+        
         # 批量处理
         print(f"\n🚀 开始批量处理 {len(to_process)} 个视频...\n")
         success_count = 0
         fail_count = 0
+        summarizer = DeepSeekSummarizer()
         
-        for i, video in enumerate(to_process, 1):
-            print(f"\n{'='*60}")
-            print(f"处理进度: {i}/{len(to_process)}")
-            print(f"{'='*60}")
-            
-            try:
-                process_video(video['bvid'])
-                success_count += 1
-            except Exception as e:
-                print(f"❌ 处理失败: {str(e)}")
-                fail_count += 1
+        # 后台并行下载所有音频，识别和分析按顺序进行
+        with DownloadManager() as manager:
+            futures = [manager.submit(video['bvid']) for video in to_process]
             
-            # 避免请求过快
-            if i < len(to_process):
-                print("\n⏳ 等待 3 秒后继续...")
-                import time
-                time.sleep(3)
+            for i, (video, future) in enumerate(zip(to_process, futures), 1):
+                print(f"\n{'='*60}")
+                print(f"处理进度: {i}/{len(to_process)}")
+                stats = manager.stats()
+                print(f"下载队列: 等待 {stats['queued']} | 下载中 {stats['active']} | "
+                      f"已完成 {stats['completed']} | 平均 {stats['mb_per_s']:.2f} MB/s")
+                print(f"{'='*60}")
+                
+                try:
+                    audio_path = future.result()
+                    process_video(video['bvid'], summarizer, audio_path)
+                    success_count += 1
+                except Exception as e:
+                    print(f"❌ 处理失败: {str(e)}")
+                    fail_count += 1
+                
+                # 避免请求过快
+                if i < len(to_process):
+                    print("\n⏳ 等待 3 秒后继续...")
+                    import time
+                    time.sleep(3)
         
         # 总结
         print("\n" + "=" * 60)
@@ -224,6 +321,11 @@ def process_watchlater_batch():
         print("=" * 60)
         print(f"✅ 成功: {success_count} 个")
         print(f"❌ 失败: {fail_count} 个")
+        usage = summarizer.usage_report()
+        print(f"💰 AI 用量: {usage['prompt_tokens'] + usage['completion_tokens']} tokens，"
+              f"约 ¥{usage['cost']:.4f}，AI 耗时 {usage['latency']:.1f}s")
+        if usage['cost'] > 0:
+            print(f"📈 每元处理视频数: {success_count / usage['cost']:.1f}")
         print("=" * 60 + "\n")
     
     except Exception as e:
@@ -243,8 +345,8 @@ def main():
     if len(sys.argv) > 1:
         # 命令行参数模式
         if sys.argv[1] == "--watchlater" or sys.argv[1] == "-w":
-            # 批量处理稍后再看
-            process_watchlater_batch()
+            # 批量处理稍后再看，--triage 表示直接按筛选规则处理
+            process_watchlater_batch(auto_triage="--triage" in sys.argv[2:])
         else:
             # 处理单个BV号
             bv_id = sys.argv[1]
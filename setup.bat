@@ -10,7 +10,7 @@ echo.
 REM 检查 Python 是否已安装
 python --version >nul 2>&1
 if errorlevel 1 (
-    echo [错误] 未检测到 Python，请先安装 Python 3.8+
+    echo [错误] 未检测到 Python，请先安装 Python 3.9+
     echo 下载地址: https://www.python.org/downloads/
     pause
     exit /b 1
@@ -9,7 +9,7 @@ echo ""
 
 # 检查 Python 是否已安装
 if ! command -v python3 &> /dev/null; then
-    echo "[错误] 未检测到 Python3，请先安装 Python 3.8+"
+    echo "[错误] 未检测到 Python3，请先安装 Python 3.9+"
     exit 1
 fi
 
@@ -3,17 +3,242 @@ AI 文本加工模块
 调用 DeepSeek API 对转录文本进行摘要和分析
 """
 import os
+import re
+import math
+import time
+from array import array
 from openai import OpenAI
 from dotenv import load_dotenv
 
 # 加载环境变量
 load_dotenv()
 
+# 粗略估算：中文转录约 1.6 字符 ≈ 1 token
+CHARS_PER_TOKEN = 1.6
+
+# 按转录长度（字符数）路由
+LOCAL_MAX_CHARS = 200       # 不超过该长度的转录直接本地抽取，不调用 LLM
+BRIEF_MAX_CHARS = 1500      # 不超过该长度的转录使用精简 Prompt
+LONG_MIN_CHARS = 20000      # 超过该长度的转录先用 TextRank 抽取关键句
+LONG_TARGET_CHARS = 12000   # 长转录抽取后保留的字符数
+
+# 单次调用至少需要的 token 预算，不足时退回本地抽取
+MIN_CALL_TOKENS = 1000
+# system prompt 等固定开销的估算 token 数
+PROMPT_OVERHEAD_TOKENS = 500
+
+# 章节索引的输出上限，以及时间轴至少需要的字符数，不足时不生成章节
+CHAPTER_MAX_TOKENS = 800
+CHAPTER_MIN_INPUT_CHARS = 1000
+
+# 匹配句子结尾，用于 TextRank 分句
+_SENTENCE_END = re.compile(r"(?<=[。！？!?；;…\n])")
+# 无标点的长文本按该长度切句
+_MAX_SENTENCE_CHARS = 120
+# TextRank 最多参与计算的句子数，超出时合并相邻句子
+_MAX_TEXTRANK_UNITS = 400
+
+# 匹配模型输出的章节行，如 "03:15 章节标题" 或 "[1:02:03] 章节标题"
+_CHAPTER_LINE = re.compile(r"^(?:\d+[.、)]\s*)?[-*•\s]*\[?\**((?:\d{1,2}:)?\d{1,2}:\d{2})\**\]?\s*[-–—:：|]?\s*(.+)$")
+
+
+def format_timestamp(seconds):
+    """
+    将秒数格式化为 mm:ss 或 h:mm:ss
+    :param seconds: 秒数
+    :return: 时间字符串
+    """
+    seconds = int(seconds or 0)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
+
+
+def parse_timestamp(value):
+    """
+    将 mm:ss 或 h:mm:ss 解析为秒数
+    :param value: 时间字符串
+    :return: 秒数
+    """
+    seconds = 0
+    for part in value.split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+class ChapterIndex:
+    """
+    章节索引：起始秒数存放在紧凑的 array 中，标题与之按下标一一对应
+    """
+    
+    def __init__(self, starts=(), titles=()):
+        """
+        :param starts: 各章节起始秒数
+        :param titles: 各章节标题（含要点）
+        """
+        self.starts = array('I', starts)
+        self.titles = list(titles)
+        if len(self.starts) != len(self.titles):
+            raise ValueError("章节起始时间与标题数量不一致")
+    
+    def __len__(self):
+        return len(self.starts)
+    
+    def __iter__(self):
+        return zip(self.starts, self.titles)
+    
+    def url(self, bv_id, index):
+        """
+        生成跳转到指定章节的视频链接
+        :param bv_id: 视频BV号
+        :param index: 章节序号
+        :return: 带 ?t= 偏移的视频链接
+        """
+        return f"https://www.bilibili.com/video/{bv_id}?t={self.starts[index]}"
+    
+    def to_dict(self):
+        """
+        转换为可 JSON 序列化的字典
+        """
+        return {'starts': self.starts.tolist(), 'titles': self.titles}
+    
+    @classmethod
+    def from_dict(cls, data):
+        """
+        从 to_dict 的结果恢复章节索引
+        """
+        return cls(data.get('starts', []), data.get('titles', []))
+
+
+def split_sentences(text):
+    """
+    按中英文句末标点分句，无标点的长文本按固定长度切开
+    :param text: 文本
+    :return: 句子列表
+    """
+    sentences = []
+    for piece in _SENTENCE_END.split(text):
+        piece = piece.strip()
+        for i in range(0, len(piece), _MAX_SENTENCE_CHARS):
+            sentences.append(piece[i:i + _MAX_SENTENCE_CHARS])
+    return sentences
+
+
+def _char_bigrams(sentence):
+    """
+    提取句子的字符二元组，作为中文句子相似度的特征
+    """
+    chars = [c for c in sentence if c.isalnum()]
+    return {a + b for a, b in zip(chars, chars[1:])}
+
+
+def textrank_extract(text, max_chars, damping=0.85, iterations=30):
+    """
+    TextRank 抽取式摘要：按句子重要性挑选关键句，保持原文顺序
+    :param text: 原文
+    :param max_chars: 输出的最大字符数
+    :param damping: 阻尼系数
+    :param iterations: 迭代次数
+    :return: 抽取后的文本，原文不超过 max_chars 时原样返回
+    """
+    if len(text) <= max_chars:
+        return text
+    
+    sentences = split_sentences(text)
+    
+    # 句子过多时合并相邻句子，控制两两相似度的计算量
+    if len(sentences) > _MAX_TEXTRANK_UNITS:
+        group = math.ceil(len(sentences) / _MAX_TEXTRANK_UNITS)
+        sentences = ["".join(sentences[i:i + group]) for i in range(0, len(sentences), group)]
+    
+    features = [_char_bigrams(sentence) for sentence in sentences]
+    count = len(sentences)
+    
+    # 构建相似度图（邻接表）
+    neighbors = [[] for _ in range(count)]
+    weight_sums = [0.0] * count
+    for i in range(count):
+        if not features[i]:
+            continue
+        for j in range(i + 1, count):
+            overlap = len(features[i] & features[j])
+            if not overlap:
+                continue
+            weight = overlap / (math.log(len(features[i]) + 1) + math.log(len(features[j]) + 1))
+            neighbors[i].append((j, weight))
+            neighbors[j].append((i, weight))
+            weight_sums[i] += weight
+            weight_sums[j] += weight
+    
+    scores = [1.0] * count
+    for _ in range(iterations):
+        scores = [
+            (1 - damping) + damping * sum(
+                weight * scores[j] / weight_sums[j] for j, weight in neighbors[i]
+            )
+            for i in range(count)
+        ]
+    
+    # 按得分选句，直到达到字符上限，再按原文顺序输出
+    selected = []
+    total = 0
+    for i in sorted(range(count), key=lambda k: scores[k], reverse=True):
+        if total + len(sentences[i]) > max_chars:
+            continue
+        selected.append(i)
+        total += len(sentences[i])
+    
+    if not selected:
+        return text[:max_chars]
+    
+    return "\n".join(sentences[i] for i in sorted(selected))
+
+
+STANDARD_SYSTEM_PROMPT = """你是一位专业的视频内容分析师。你的任务是帮助用户快速了解一个 B 站视频的价值，避免浪费时间。
+
+请根据用户提供的视频转录文本，提供以下内容：
+
+1. **视频概要**（1-2 句话）：用简洁的语言总结视频主题。
+2. **核心要点**（3-5 个要点）：提取视频中最重要的信息点。
+3. **信息密度评估**（高/中/低）：评价该视频的信息量和价值。
+4. **观看建议**：
+   - 值得看：如果视频内容实用、信息量大、无明显营销。
+   - 选择性观看：如果有部分有价值的内容，但存在冗余或营销。
+   - 不建议看：如果视频是明显的标题党、废话太多或纯营销内容。
+5. **潜在风险提示**（如有）：识别视频中是否存在误导信息、过度营销、情绪煽动等问题。
+
+请以结构化、易读的格式输出你的分析结果。"""
+
+BRIEF_SYSTEM_PROMPT = """你是一位专业的视频内容分析师。用户会提供一个较短 B 站视频的转录文本，请简明地给出：
+
+1. **视频概要**（1 句话）
+2. **核心要点**（1-3 个）
+3. **观看建议**（值得看 / 选择性观看 / 不建议看，附一句理由）
+4. **潜在风险提示**（如有，没有则省略）
+
+请保持简短，使用结构化格式输出。"""
+
+LONG_PROMPT_NOTE = """
+
+注意：该视频较长，用户提供的是按重要性从完整转录中抽取的关键句（保持原文顺序），句子之间可能不连贯。"""
+
+# 路由档位：Prompt 变体与输出预算
+SUMMARY_ROUTES = {
+    'brief': {'system_prompt': BRIEF_SYSTEM_PROMPT, 'max_tokens': 600, 'temperature': 0.5},
+    'standard': {'system_prompt': STANDARD_SYSTEM_PROMPT, 'max_tokens': 2000, 'temperature': 0.7},
+    'long': {'system_prompt': STANDARD_SYSTEM_PROMPT + LONG_PROMPT_NOTE, 'max_tokens': 2000, 'temperature': 0.7},
+}
+
 
 class DeepSeekSummarizer:
-    def __init__(self):
+    def __init__(self, token_budget=None, cost_budget=None):
         """
         初始化 DeepSeek 客户端
+        同一个实例内的所有调用共享 token / 费用预算，批量处理时应复用同一实例
+        :param token_budget: 本批次 token 预算，默认读取 DEEPSEEK_BATCH_TOKEN_BUDGET，0 表示不限
+        :param cost_budget: 本批次费用预算（元），默认读取 DEEPSEEK_BATCH_COST_BUDGET，0 表示不限
         """
         api_key = os.getenv("DEEPSEEK_API_KEY")
         if not api_key:
@@ -25,7 +250,128 @@ class DeepSeekSummarizer:
             base_url="https://api.deepseek.com"
         )
         
-        self.model = "deepseek-chat"
+        self.model = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+        self.long_model = os.getenv("DEEPSEEK_LONG_MODEL", self.model)
+        
+        # 价格：元 / 百万 tokens
+        self.price_input = float(os.getenv("DEEPSEEK_PRICE_INPUT", "2"))
+        self.price_output = float(os.getenv("DEEPSEEK_PRICE_OUTPUT", "3"))
+        
+        if token_budget is None:
+            token_budget = int(os.getenv("DEEPSEEK_BATCH_TOKEN_BUDGET", "0"))
+        if cost_budget is None:
+            cost_budget = float(os.getenv("DEEPSEEK_BATCH_COST_BUDGET", "0"))
+        self.token_budget = token_budget
+        self.cost_budget = cost_budget
+        
+        # 最近一次 analyze 选择的路由，'name' 为 'local' 时未调用 LLM
+        self.last_route = None
+        
+        # 每次调用的用量记录
+        self.usage_log = []
+        self.spent_tokens = 0
+        self.spent_cost = 0.0
+    
+    def remaining_tokens(self):
+        """
+        估算本批次剩余可用的 token 数
+        :return: 剩余 token 数，未设置预算时返回 None
+        """
+        limits = []
+        if self.token_budget:
+            limits.append(self.token_budget - self.spent_tokens)
+        if self.cost_budget:
+            # 按较贵的输出单价折算，保守估计
+            price = max(self.price_input, self.price_output)
+            limits.append(int((self.cost_budget - self.spent_cost) / price * 1_000_000))
+        if not limits:
+            return None
+        return max(0, min(limits))
+    
+    def _record_usage(self, label, model, response, latency):
+        """
+        记录一次调用的 token 用量、费用和耗时
+        """
+        usage = getattr(response, 'usage', None)
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        cost = (prompt_tokens * self.price_input + completion_tokens * self.price_output) / 1_000_000
+        
+        self.usage_log.append({
+            'label': label,
+            'model': model,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cost': cost,
+            'latency': latency,
+        })
+        self.spent_tokens += prompt_tokens + completion_tokens
+        self.spent_cost += cost
+        
+        print(f"[AI] {label} 用量: {prompt_tokens}+{completion_tokens} tokens，"
+              f"约 ¥{cost:.4f}，耗时 {latency:.1f}s")
+    
+    def usage_report(self, start=0):
+        """
+        汇总 usage_log[start:] 的用量
+        :param start: 起始下标，可传入处理前的 len(usage_log) 以统计单个视频
+        :return: {'calls', 'prompt_tokens', 'completion_tokens', 'cost', 'latency', 'routes'}
+        """
+        entries = self.usage_log[start:]
+        return {
+            'calls': sum(1 for e in entries if e['model']),
+            'prompt_tokens': sum(e['prompt_tokens'] for e in entries),
+            'completion_tokens': sum(e['completion_tokens'] for e in entries),
+            'cost': sum(e['cost'] for e in entries),
+            'latency': sum(e['latency'] for e in entries),
+            'routes': [e['label'] for e in entries],
+        }
+    
+    def _select_route(self, transcript_text):
+        """
+        根据转录长度和剩余预算选择模型、Prompt 变体和输出预算
+        :param transcript_text: 视频转录文本
+        :return: 路由字典，'name' 为 'local' 时表示不调用 LLM
+        """
+        length = len(transcript_text)
+        remaining = self.remaining_tokens()
+        
+        if length <= LOCAL_MAX_CHARS:
+            return {'name': 'local', 'reason': '转录文本过短', 'input_text': transcript_text}
+        if remaining is not None and remaining < MIN_CALL_TOKENS:
+            return {'name': 'local', 'reason': '批次预算已用尽', 'input_text': transcript_text}
+        
+        if length <= BRIEF_MAX_CHARS:
+            name = 'brief'
+        elif length <= LONG_MIN_CHARS:
+            name = 'standard'
+        else:
+            name = 'long'
+        
+        route = dict(SUMMARY_ROUTES[name], name=name)
+        route['model'] = self.long_model if name == 'long' else self.model
+        
+        max_input_chars = LONG_TARGET_CHARS if name == 'long' else length
+        if remaining is not None:
+            route['max_tokens'] = min(route['max_tokens'], remaining // 2)
+            input_tokens = remaining - route['max_tokens'] - PROMPT_OVERHEAD_TOKENS
+            max_input_chars = min(max_input_chars, int(input_tokens * CHARS_PER_TOKEN))
+        
+        if max_input_chars < LOCAL_MAX_CHARS:
+            return {'name': 'local', 'reason': '批次预算不足', 'input_text': transcript_text}
+        
+        route['input_text'] = textrank_extract(transcript_text, max_input_chars)
+        return route
+    
+    def _local_summary(self, transcript_text, reason):
+        """
+        不调用 LLM，直接用 TextRank 抽取关键句作为摘要
+        """
+        key_sentences = textrank_extract(transcript_text, 300)
+        quoted = "\n".join(f"> {line}" for line in key_sentences.splitlines() if line.strip())
+        return f"""**视频概要**（{reason}，未调用 AI，以下为本地抽取的关键句）
+
+{quoted}"""
     
     def analyze(self, transcript_text, bv_id=""):
         """
@@ -36,38 +382,40 @@ class DeepSeekSummarizer:
         """
         print(f"[AI] 正在分析文本内容...")
         
-        # 构建 Prompt
-        system_prompt = """你是一位专业的视频内容分析师。你的任务是帮助用户快速了解一个 B 站视频的价值，避免浪费时间。
-
-请根据用户提供的视频转录文本，提供以下内容：
-
-1. **视频概要**（1-2 句话）：用简洁的语言总结视频主题。
-2. **核心要点**（3-5 个要点）：提取视频中最重要的信息点。
-3. **信息密度评估**（高/中/低）：评价该视频的信息量和价值。
-4. **观看建议**：
-   - 值得看：如果视频内容实用、信息量大、无明显营销。
-   - 选择性观看：如果有部分有价值的内容，但存在冗余或营销。
-   - 不建议看：如果视频是明显的标题党、废话太多或纯营销内容。
-5. **潜在风险提示**（如有）：识别视频中是否存在误导信息、过度营销、情绪煽动等问题。
-
-请以结构化、易读的格式输出你的分析结果。"""
-
+        route = self._select_route(transcript_text)
+        self.last_route = route
+        
+        if route['name'] == 'local':
+            print(f"[AI] {route['reason']}，使用本地抽取摘要")
+            self.usage_log.append({
+                'label': 'local', 'model': None, 'prompt_tokens': 0,
+                'completion_tokens': 0, 'cost': 0.0, 'latency': 0.0,
+            })
+            return self._local_summary(transcript_text, route['reason'])
+        
+        input_text = route['input_text']
+        if len(input_text) < len(transcript_text):
+            print(f"[AI] 转录已抽取关键句: {len(transcript_text)} -> {len(input_text)} 字符")
+        print(f"[AI] 路由: {route['name']}，模型: {route['model']}，输出上限: {route['max_tokens']} tokens")
+        
         user_prompt = f"""以下是一个 B 站视频的转录文本：
 
-{transcript_text}
+{input_text}
 
 请对这个视频进行深入分析。"""
         
         try:
+            started = time.perf_counter()
             response = self.client.chat.completions.create(
-                model=self.model,
+                model=route['model'],
                 messages=[
-                    {"role": "system", "content": system_prompt},
+                    {"role": "system", "content": route['system_prompt']},
                     {"role": "user", "content": user_prompt}
                 ],
-                temperature=0.7,
-                max_tokens=2000
+                temperature=route['temperature'],
+                max_tokens=route['max_tokens']
             )
+            self._record_usage(route['name'], route['model'], response, time.perf_counter() - started)
             
             analysis = response.choices[0].message.content
             print(f"[AI] 分析完成！")
@@ -77,6 +425,98 @@ class DeepSeekSummarizer:
         except Exception as e:
             print(f"[错误] DeepSeek API 调用失败: {str(e)}")
             raise
+    
+    def build_chapters(self, segments, max_chapters=8, model=None):
+        """
+        根据带时间戳的分段生成章节索引
+        :param segments: ASR 分段列表 [{'start': 秒, 'end': 秒, 'text': 文本}, ...]
+        :param max_chapters: 最多生成的章节数
+        :param model: 使用的模型（可选），应与 analyze 路由选择的模型一致，默认 self.model
+        :return: ChapterIndex
+        """
+        model = model or self.model
+        if not segments:
+            return ChapterIndex()
+        
+        remaining = self.remaining_tokens()
+        if remaining is not None and remaining < MIN_CALL_TOKENS:
+            print(f"[AI] 批次预算已用尽，跳过章节索引")
+            return ChapterIndex()
+        
+        # 输出上限和时间轴长度都受剩余预算约束
+        max_tokens = CHAPTER_MAX_TOKENS
+        max_chars = LONG_TARGET_CHARS
+        if remaining is not None:
+            max_tokens = min(max_tokens, remaining // 2)
+            input_tokens = remaining - max_tokens - PROMPT_OVERHEAD_TOKENS
+            max_chars = min(max_chars, int(input_tokens * CHARS_PER_TOKEN))
+        
+        if max_chars < CHAPTER_MIN_INPUT_CHARS:
+            print(f"[AI] 批次预算不足，跳过章节索引")
+            return ChapterIndex()
+        
+        print(f"[AI] 正在生成章节索引...")
+        
+        # 长转录按分段数均摊字符上限，保证时间轴覆盖整个视频
+        lines = [(segment['start'], segment['text']) for segment in segments]
+        max_lines = max_chars // 40
+        if len(lines) > max_lines:
+            # 分段过多时合并相邻分段，以首段时间为准
+            group = math.ceil(len(lines) / max_lines)
+            lines = [
+                (lines[i][0], "".join(text for _, text in lines[i:i + group]))
+                for i in range(0, len(lines), group)
+            ]
+        line_chars = max(20, max_chars // len(lines))
+        
+        timeline = "\n".join(
+            f"[{format_timestamp(start)}] {text[:line_chars]}" for start, text in lines
+        )
+        
+        system_prompt = f"""你是一位专业的视频内容分析师。用户会提供一段带时间戳的视频转录文本，每行以 [mm:ss] 开头。
+
+请把视频划分为不超过 {max_chapters} 个章节，每个章节一行，格式严格为：
+mm:ss 章节标题：一句话要点
+
+要求：
+- 时间必须取自转录中某一行的时间戳，表示该章节的开始位置
+- 按时间先后排列，第一个章节从视频开头开始
+- 只输出章节行，不要输出其他内容"""
+        
+        try:
+            started = time.perf_counter()
+            response = self.client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": timeline}
+                ],
+                temperature=0.3,
+                max_tokens=max_tokens
+            )
+            self._record_usage('chapters', model, response, time.perf_counter() - started)
+            
+            content = response.choices[0].message.content or ""
+        
+        except Exception as e:
+            print(f"[错误] DeepSeek API 调用失败: {str(e)}")
+            raise
+        
+        # 解析章节行，限制在音频时长范围内并按时间去重
+        last_start = int(segments[-1]['start'])
+        chapters = {}
+        for line in content.splitlines():
+            match = _CHAPTER_LINE.match(line.strip())
+            if not match:
+                continue
+            start = min(parse_timestamp(match.group(1)), last_start)
+            chapters.setdefault(start, match.group(2).strip())
+        
+        starts = sorted(chapters)[:max_chapters]
+        index = ChapterIndex(starts, [chapters[start] for start in starts])
+        print(f"[AI] 章节索引生成完成，共 {len(index)} 个章节")
+        
+        return index
 
 
 if __name__ == "__main__":
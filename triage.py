@@ -0,0 +1,177 @@
+"""
+稍后再看筛选模块
+在下载之前根据视频元数据（时长、UP主、标题、播放数据、标签）过滤并排序
+"""
+import os
+import math
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+# 支持的排序方式：得分最高优先 / 时长最短优先 / 保持列表原顺序
+ORDERS = ('score', 'shortest', 'original')
+
+
+def _env_list(name):
+    """
+    读取逗号分隔的环境变量，返回去空格、转小写后的列表
+    """
+    return [item.strip().lower() for item in os.getenv(name, "").split(",") if item.strip()]
+
+
+class TriageConfig:
+    def __init__(self, max_duration=None, min_duration=0, skip_owners=(), skip_keywords=(),
+                 prefer_owners=(), prefer_keywords=(), order='score', fetch_details=True):
+        """
+        筛选配置
+        :param max_duration: 最长时长（秒），超过则跳过，None 表示不限
+        :param min_duration: 最短时长（秒），不足则跳过
+        :param skip_owners: 总是跳过的 UP 主
+        :param skip_keywords: 标题或标签包含这些关键词时跳过
+        :param prefer_owners: 优先处理的 UP 主
+        :param prefer_keywords: 标题或标签包含这些关键词时加分
+        :param order: 排序方式，见 ORDERS
+        :param fetch_details: 是否批量获取播放数据和标签
+        """
+        if order not in ORDERS:
+            raise ValueError(f"不支持的排序方式: {order}，可选: {', '.join(ORDERS)}")
+        
+        self.max_duration = max_duration
+        self.min_duration = min_duration
+        self.skip_owners = [owner.lower() for owner in skip_owners]
+        self.skip_keywords = [keyword.lower() for keyword in skip_keywords]
+        self.prefer_owners = [owner.lower() for owner in prefer_owners]
+        self.prefer_keywords = [keyword.lower() for keyword in prefer_keywords]
+        self.order = order
+        self.fetch_details = fetch_details
+    
+    @classmethod
+    def from_env(cls):
+        """
+        从环境变量读取筛选配置
+        """
+        max_minutes = float(os.getenv("TRIAGE_MAX_MINUTES", "90"))
+        return cls(
+            max_duration=int(max_minutes * 60) if max_minutes > 0 else None,
+            min_duration=int(os.getenv("TRIAGE_MIN_SECONDS", "0")),
+            skip_owners=_env_list("TRIAGE_SKIP_OWNERS"),
+            skip_keywords=_env_list("TRIAGE_SKIP_KEYWORDS"),
+            prefer_owners=_env_list("TRIAGE_PREFER_OWNERS"),
+            prefer_keywords=_env_list("TRIAGE_PREFER_KEYWORDS"),
+            order=os.getenv("TRIAGE_ORDER", "score").strip().lower(),
+            fetch_details=os.getenv("TRIAGE_FETCH_DETAILS", "1") != "0",
+        )
+
+
+def _searchable_text(video):
+    """
+    用于关键词匹配的文本：标题、分区和标签
+    """
+    parts = [video.get('title', ''), video.get('tname', '')] + list(video.get('tags', []))
+    return " ".join(parts).lower()
+
+
+def check_video(video, config):
+    """
+    按规则检查视频是否应被跳过
+    :param video: 视频信息字典
+    :param config: TriageConfig
+    :return: 跳过原因，保留时返回 None
+    """
+    duration = video.get('duration', 0)
+    if config.max_duration and duration > config.max_duration:
+        return f"时长 {duration // 60} 分钟，超过上限 {config.max_duration // 60} 分钟"
+    if duration < config.min_duration:
+        return f"时长 {duration} 秒，低于下限 {config.min_duration} 秒"
+    
+    if video.get('owner', '').lower() in config.skip_owners:
+        return f"UP主 {video.get('owner')} 在跳过列表中"
+    
+    text = _searchable_text(video)
+    for keyword in config.skip_keywords:
+        if keyword in text:
+            return f"包含跳过关键词「{keyword}」"
+    
+    return None
+
+
+def score_video(video, config):
+    """
+    计算视频的优先级得分，越高越值得先处理
+    :param video: 视频信息字典
+    :param config: TriageConfig
+    :return: 得分
+    """
+    score = 0.0
+    
+    # 播放量取对数，点赞率按百分比计
+    view = video.get('view', 0) or 0
+    like = video.get('like', 0) or 0
+    score += math.log10(view + 1)
+    if view:
+        score += min(like / view * 100, 20) / 2
+    
+    if video.get('owner', '').lower() in config.prefer_owners:
+        score += 5
+    
+    text = _searchable_text(video)
+    score += 2 * sum(1 for keyword in config.prefer_keywords if keyword in text)
+    
+    # 越长的视频处理成本越高，每 30 分钟扣 1 分
+    score -= video.get('duration', 0) / 1800
+    
+    return round(score, 2)
+
+
+def triage_videos(videos, config=None, api=None):
+    """
+    筛选并排序待处理视频，全部在下载之前完成
+    先用列表自带的元数据过滤，再只为剩下的视频批量获取播放数据和标签
+    :param videos: BilibiliAPI.get_watchlater_list 返回的视频列表
+    :param config: TriageConfig，默认从环境变量读取
+    :param api: BilibiliAPI 实例（可选），用于获取视频详情
+    :return: (保留的视频列表, [(跳过的视频, 原因), ...])，保留的视频带有 'score' 字段
+    """
+    if config is None:
+        config = TriageConfig.from_env()
+    
+    kept = []
+    skipped = []
+    for video in videos:
+        reason = check_video(video, config)
+        if reason:
+            skipped.append((video, reason))
+        else:
+            kept.append(dict(video))
+    
+    # 标签匹配需要详情，被基础规则跳过的视频不再请求
+    if api is not None and config.fetch_details and kept:
+        details = api.get_video_details_batch([video['bvid'] for video in kept])
+        remaining = []
+        for video in kept:
+            detail = details.get(video['bvid'])
+            if detail:
+                video.update({key: value for key, value in detail.items() if value})
+            reason = check_video(video, config)
+            if reason:
+                skipped.append((video, reason))
+            else:
+                remaining.append(video)
+        kept = remaining
+    
+    for video in kept:
+        video['score'] = score_video(video, config)
+    
+    if config.order == 'score':
+        kept.sort(key=lambda video: video['score'], reverse=True)
+    elif config.order == 'shortest':
+        kept.sort(key=lambda video: video.get('duration', 0))
+    
+    return kept, skipped
+
+
+if __name__ == "__main__":
+    # 测试代码
+    config = TriageConfig.from_env()
+    print(f"筛选模块已就绪，排序方式: {config.order}，请在主程序中调用。")